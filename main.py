@@ -1,44 +1,242 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from streamlit_option_menu import option_menu
 import pandas as pd
 from google import genai
 from google.genai import types
-from typing import List, Dict
-import plotly.express as px
+from typing import List, Dict, Iterator, Tuple
+import pyarrow as pa
+import pyarrow.csv
+import asyncio
+import functools
+import hashlib
+import io
+import json
 import os
+import sqlite3
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
 from dotenv import load_dotenv
-from serpapi import GoogleSearch
 
-# Load environment variables
-load_dotenv()
+# Short templated prompts use the faster tier; open-ended questions use the stronger one
+MODEL_FAST = "gemini-2.5-flash-lite"
+MODEL_QUALITY = "gemini-2.5-flash"
+# 2.5-flash thinking tokens count against max_output_tokens, so cap them explicitly
+QUALITY_THINKING_BUDGET = 512
+
+MAX_CONCURRENT_BATCHES = 4
+MAX_PLOT_POINTS = 20000
+MISSING_VALUES_SPEC = {
+    "mark": "bar",
+    "encoding": {
+        "x": {"field": "column", "type": "nominal", "sort": None},
+        "y": {"field": "missing", "type": "quantitative"}
+    }
+}
+LLM_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache.sqlite")
+LLM_CACHE_TTL = 7 * 24 * 3600
+
+# Load environment variables from .env once per process
+@functools.lru_cache(maxsize=1)
+def _load_env():
+    load_dotenv()
+
+# Streamlit raises when no secrets.toml exists at all; treat that as "not set"
+def _get_secret(name: str):
+    try:
+        return st.secrets[name] if name in st.secrets else None
+    except FileNotFoundError:
+        return None
 
 # Get API key from environment or Streamlit secrets
 def get_api_keys():
+    _load_env()
     api_key = os.getenv('GOOGLE_API_KEY')
     if not api_key:
-        if 'GOOGLE_API_KEY' in st.secrets:
-            api_key = st.secrets['GOOGLE_API_KEY']
+        api_key = _get_secret('GOOGLE_API_KEY')
 
     serp_api_key = os.getenv('SERP_API_KEY')
     if not serp_api_key:
-        if 'SERP_API_KEY' in st.secrets:
-            serp_api_key = st.secrets['SERP_API_KEY']
+        serp_api_key = _get_secret('SERP_API_KEY')
     return api_key , serp_api_key
     
 
-class CSVEnrichmentAgent:
-    def __init__(self):
-        google_key, serp_key = get_api_keys()
+# Persistent Gemini response cache shared across sessions and restarts
+def llm_cache_key(model: str, prompt: str, temperature: float, max_output_tokens: int,
+                  response_mime_type: str = None, thinking_budget: int = None) -> str:
+    request = f"{model}|{prompt}|{temperature}|{max_output_tokens}|{response_mime_type}|{thinking_budget}"
+    return hashlib.blake2b(request.encode()).hexdigest()
+
+
+@functools.lru_cache(maxsize=1)
+def _init_llm_cache():
+    with closing(sqlite3.connect(LLM_CACHE_PATH, timeout=1)) as conn, conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_responses "
+            "(key TEXT PRIMARY KEY, response TEXT, expires_at REAL)"
+        )
+
+
+# The sqlite layer is optional: any database error (read-only directory, locked
+# file) is treated as a cache miss or a skipped write, never as a failed request
+def llm_cache_get(key: str):
+    try:
+        _init_llm_cache()
+        with closing(sqlite3.connect(LLM_CACHE_PATH, timeout=1)) as conn:
+            row = conn.execute(
+                "SELECT response FROM llm_responses WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+
+def llm_cache_set(key: str, response: str):
+    if not response:
+        return
+    try:
+        _init_llm_cache()
+        with closing(sqlite3.connect(LLM_CACHE_PATH, timeout=1)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_responses (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, response, time.time() + LLM_CACHE_TTL)
+            )
+    except sqlite3.Error:
+        pass
+
+
+def is_complete(response) -> bool:
+    # Only answers that ended naturally are worth persisting; MAX_TOKENS or
+    # safety stops would otherwise be replayed as if they were complete
+    return bool(response.candidates) and response.candidates[0].finish_reason == types.FinishReason.STOP
 
+
+# Gemini responses keyed on the full request, so page switches with unchanged
+# inputs are served locally instead of re-issuing the API call
+@st.cache_data(ttl=3600, show_spinner=False)
+def generate_text(_client, model: str, prompt: str, temperature: float, max_output_tokens: int) -> str:
+    key = llm_cache_key(model, prompt, temperature, max_output_tokens)
+    cached = llm_cache_get(key)
+    if cached is not None:
+        return cached
+
+    response = _client.models.generate_content(
+        model=model,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens
+        )
+    )
+    # Raising keeps st.cache_data from holding on to a blocked, empty or truncated answer
+    if not response.text:
+        raise ValueError("Gemini returned an empty response")
+    if not is_complete(response):
+        raise ValueError(f"Gemini response was cut off ({response.candidates[0].finish_reason})")
+    llm_cache_set(key, response.text)
+    return response.text
+
+
+def stream_text(client, model: str, prompt: str, temperature: float, max_output_tokens: int,
+                thinking_budget: int = None) -> Iterator[str]:
+    key = llm_cache_key(model, prompt, temperature, max_output_tokens, thinking_budget=thinking_budget)
+    cached = llm_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    chunks = []
+    complete = False
+    for chunk in client.models.generate_content_stream(
+        model=model,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            thinking_config=(
+                types.ThinkingConfig(thinking_budget=thinking_budget) if thinking_budget is not None else None
+            )
+        )
+    ):
+        complete = is_complete(chunk)
+        if chunk.text:
+            chunks.append(chunk.text)
+            yield chunk.text
+    if complete:
+        llm_cache_set(key, "".join(chunks))
+
+
+async def generate_text_async(aclient, model: str, prompt: str, temperature: float, max_output_tokens: int,
+                              response_mime_type: str = None) -> str:
+    key = llm_cache_key(model, prompt, temperature, max_output_tokens, response_mime_type)
+    cached = llm_cache_get(key)
+    if cached is not None:
+        return cached
+
+    response = await aclient.models.generate_content(
+        model=model,
+        contents=prompt,
+        config=types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            response_mime_type=response_mime_type
+        )
+    )
+    if is_complete(response):
+        llm_cache_set(key, response.text)
+    return response.text
+
+
+# Repeated searches within the TTL are served without a SerpAPI round trip
+@st.cache_data(ttl=600, show_spinner=False)
+def search_web(query: str, api_key: str) -> List[Dict]:
+    from serpapi import GoogleSearch
+
+    search = GoogleSearch({
+        "q": query,
+        "api_key": api_key
+    })
+
+    results = search.get_dict()
+    return [
+        {
+            "title": r.get("title"),
+            "snippet": r.get("snippet"),
+            "link": r.get("link")
+        }
+        for r in results.get("organic_results", [])
+    ]
+
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4)
+
+
+def run_in_background(fn, *args) -> Future:
+    # Worker threads get the script context so the st.cache_data lookups behave as usual
+    ctx = get_script_run_ctx()
+
+    def call():
+        add_script_run_ctx(ctx=ctx)
+        return fn(*args)
+
+    return get_executor().submit(call)
+
+
+class CSVEnrichmentAgent:
+    def __init__(self, google_key: str, serp_key: str = None):
         if not google_key:
             st.error("Google API Key not found")
             st.stop()
 
+        self.api_key = google_key
         self.client = genai.Client(api_key=google_key)
         self.serp_key = serp_key
 
-    def analyze_columns(self, columns: List[str]) -> str:
-        prompt = f"""
+    def _analysis_prompt(self, columns: List[str]) -> str:
+        return f"""
         Analyze these dataset columns:
         {columns}
 
@@ -48,18 +246,8 @@ class CSVEnrichmentAgent:
         3. Suggested Visualizations
         """
 
-        response = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.4,
-                max_output_tokens=4000
-            )
-        )
-        return response.text
-
-    def suggest_enrichments(self, columns: List[str], sample_data: str) -> str:
-        prompt = f"""
+    def _enrichment_prompt(self, columns: List[str], sample_data: str) -> str:
+        return f"""
         Dataset Columns:
         {columns}
 
@@ -69,41 +257,116 @@ class CSVEnrichmentAgent:
         Suggest valuable enrichment opportunities.
         """
 
-        response = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.5,
-                max_output_tokens=4000
-            )
-        )
-        return response.text
+    def analyze_columns(self, columns: List[str]) -> str:
+        prompt = self._analysis_prompt(columns)
+        return generate_text(self.client, MODEL_FAST, prompt, 0.4, 1024)
+
+    def suggest_enrichments(self, columns: List[str], sample_data: str) -> str:
+        prompt = self._enrichment_prompt(columns, sample_data)
+        return generate_text(self.client, MODEL_FAST, prompt, 0.5, 1024)
+
+    def prefetch_analysis(self, columns: List[str], sample_data: str,
+                          names: Tuple[str, ...] = ("analysis", "suggestions")) -> Dict[str, Future]:
+        # The analysis and enrichment calls are independent, so each runs in the
+        # background and its page waits only for its own result
+        calls = {
+            "analysis": (self.analyze_columns, columns),
+            "suggestions": (self.suggest_enrichments, columns, sample_data)
+        }
+        return {name: run_in_background(*calls[name]) for name in names}
+
+    def _enrich_batch_prompt(self, rows: List[Dict], instruction: str) -> str:
+        numbered = [{"index": i, "row": row} for i, row in enumerate(rows)]
+        return f"""
+        Enrich each of the following dataset rows.
+
+        Task:
+        {instruction}
+
+        Rows (JSON):
+        {json.dumps(numbered, default=str)}
+
+        Respond with a JSON list containing one object per row, each with
+        the row's "index" and the new fields as additional keys.
+        """
+
+    async def _enrich_batches(self, batches: List[List[Dict]], instruction: str):
+        # The async client is created and closed inside this event loop; the cached
+        # agent's client would otherwise reuse connections bound to an earlier loop
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+
+        async def enrich_batch(aclient, batch: List[Dict]) -> str:
+            async with semaphore:
+                return await generate_text_async(aclient, MODEL_FAST, self._enrich_batch_prompt(batch, instruction),
+                                                 0.2, 4000, response_mime_type="application/json")
+
+        async with genai.Client(api_key=self.api_key).aio as aclient:
+            return await asyncio.gather(*[enrich_batch(aclient, batch) for batch in batches], return_exceptions=True)
+
+    def enrich_rows(self, rows: List[Dict], instruction: str,
+                    batch_size: int = 20) -> Tuple[List[Dict], List[int]]:
+        # Several rows share one prompt to amortize request overhead and rate limits;
+        # up to MAX_CONCURRENT_BATCHES batches are in flight at once. Returns one dict
+        # per row plus the numbers of batches whose request or response failed, so
+        # callers can tell "nothing to add" from "no answer".
+        batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+        responses = asyncio.run(self._enrich_batches(batches, instruction))
+
+        enriched = []
+        failed = []
+        for number, (batch, text) in enumerate(zip(batches, responses)):
+            by_index = {}
+            try:
+                if isinstance(text, Exception):
+                    raise text
+                items = json.loads(text)
+                if not isinstance(items, list):
+                    raise ValueError("expected a JSON list")
+                for item in items:
+                    if isinstance(item, dict) and "index" in item:
+                        by_index[int(item.pop("index"))] = item
+            except Exception:
+                failed.append(number)
+                by_index = {}
+            enriched.extend(by_index.get(i, {}) for i in range(len(batch)))
+        return enriched, failed
 
-    def chat_with_csv(self, query: str, df: pd.DataFrame) -> str:
+    def apply_enrichments(self, df: pd.DataFrame, enriched: List[Dict]) -> pd.DataFrame:
+        # Group the per-row results by column so each new column is written in one
+        # vectorized assignment instead of one cell at a time. Fields that collide
+        # with existing columns are ignored; enrichment only adds data.
+        if len(enriched) > len(df):
+            raise ValueError(f"Got {len(enriched)} enrichment results for {len(df)} rows")
+
+        updates_by_col: Dict[str, List[Tuple[int, object]]] = {}
+        for row, fields in enumerate(enriched):
+            for col, value in fields.items():
+                if col not in df.columns:
+                    updates_by_col.setdefault(col, []).append((row, value))
+
+        df = df.copy()
+        for col, pairs in updates_by_col.items():
+            # Built as an object Series so list or dict values stay single cells
+            values = pd.Series(dict(pairs), index=range(len(df)), dtype=object)
+            df[col] = values.to_numpy()
+        return df
+
+    def chat_with_csv(self, query: str, sample_data: str) -> Iterator[str]:
         prompt = f"""
         You are a data analyst.
 
         Sample Data:
-        {df.head().to_string()}
+        {sample_data}
 
         Question:
         {query}
         """
 
-        response = self.client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.3,
-                max_output_tokens=4000
-            )
-        )
-        return response.text
+        return stream_text(self.client, MODEL_QUALITY, prompt, 0.3, 2048, thinking_budget=QUALITY_THINKING_BUDGET)
 
     def generate_insights(self, df: pd.DataFrame) -> Dict:
         return {
-            "statistics": df.describe(include="all"),
-            "missing_values": df.isnull().sum(),
+            "missing_values": df.isna().sum(),
             "row_count": len(df),
             "column_count": len(df.columns)
         }
@@ -112,52 +375,297 @@ class CSVEnrichmentAgent:
         if not self.serp_key:
             return []
 
-        search = GoogleSearch({
-            "q": query,
-            "api_key": self.serp_key
+        return search_web(query, self.serp_key)
+
+
+# One agent per key pair, so a corrected key builds a fresh client instead of
+# reusing whichever client was created first in this process
+@st.cache_resource
+def get_agent(google_key: str, serp_key: str = None):
+    return CSVEnrichmentAgent(google_key, serp_key)
+
+
+def downcast_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    # Smallest integer types that fit, and categories for repetitive text columns.
+    # Floats are left alone: float32 would change the values users and prompts see.
+    for col in df.select_dtypes(include="integer").columns:
+        df[col] = pd.to_numeric(df[col], downcast="integer")
+    for col in df.select_dtypes(include=["object", "string"]).columns:
+        if len(df) and df[col].nunique() / len(df) < 0.5:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def unique_column_names(names: List[str]) -> List[str]:
+    # Same naming pandas.read_csv uses: "Unnamed: i" for blank headers, "a.1" for repeats
+    originals = set(names)
+    used = set()
+    result = []
+    for i, name in enumerate(names):
+        name = name or f"Unnamed: {i}"
+        candidate, n = name, 0
+        while candidate in used or (n and candidate in originals):
+            n += 1
+            candidate = f"{name}.{n}"
+        used.add(candidate)
+        result.append(candidate)
+    return result
+
+
+@st.cache_data(show_spinner=False)
+def load_csv(file_bytes: bytes) -> pd.DataFrame:
+    # Parse straight from the uploaded bytes and keep the columns in Arrow buffers.
+    # Arrow's reader is stricter than pandas (e.g. ragged rows), so anything it
+    # rejects goes through pandas instead, still with Arrow-backed columns.
+    try:
+        table = pa.csv.read_csv(
+            pa.BufferReader(pa.py_buffer(file_bytes)),
+            parse_options=pa.csv.ParseOptions(newlines_in_values=True)
+        )
+    except pa.ArrowInvalid:
+        df = pd.read_csv(io.BytesIO(file_bytes), dtype_backend="pyarrow")
+    else:
+        table = table.rename_columns(unique_column_names(table.column_names))
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+    return downcast_dtypes(df)
+
+
+def sample_for_plot(df: pd.DataFrame) -> pd.DataFrame:
+    # Keep large point clouds responsive in the browser; row order is preserved for line charts
+    if len(df) > MAX_PLOT_POINTS:
+        return df.sample(MAX_PLOT_POINTS, random_state=0).sort_index()
+    return df
+
+
+@st.fragment
+def render_visualizations(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key):
+    # Imported here so other pages don't pay plotly's import cost
+    import plotly.express as px
+
+    st.header("📈 Visualizations")
+    
+    # Dynamic visualization options based on data types
+    numeric_cols = st.session_state["numeric_cols"]
+    categorical_cols = st.session_state["categorical_cols"]
+    
+    # Visualization type selector
+    viz_type = st.selectbox(
+        "Choose visualization type",
+        ["Scatter Plot", "Bar Chart", "Line Chart", "Box Plot"]
+    )
+    
+    if viz_type == "Scatter Plot" and len(numeric_cols) >= 2:
+        x_col = st.selectbox("Select X axis", numeric_cols, key="scatter_x")
+        y_col = st.selectbox("Select Y axis", numeric_cols, key="scatter_y")
+        fig = px.scatter(sample_for_plot(df), x=x_col, y=y_col, render_mode='webgl')
+        st.plotly_chart(fig, key=f"viz_{viz_type}")
+        
+    elif viz_type == "Bar Chart" and len(categorical_cols) > 0:
+        x_col = st.selectbox("Select category", categorical_cols)
+        if len(numeric_cols) > 0:
+            y_col = st.selectbox("Select value", numeric_cols)
+            fig = px.bar(df, x=x_col, y=y_col)
+            st.plotly_chart(fig, key=f"viz_{viz_type}")
+            
+    elif viz_type == "Line Chart" and len(numeric_cols) > 0:
+        y_col = st.selectbox("Select value", numeric_cols)
+        fig = px.line(sample_for_plot(df), y=y_col, render_mode='webgl')
+        st.plotly_chart(fig, key=f"viz_{viz_type}")
+        
+    elif viz_type == "Box Plot" and len(numeric_cols) > 0:
+        y_col = st.selectbox("Select value", numeric_cols)
+        if len(categorical_cols) > 0:
+            x_col = st.selectbox("Select category (optional)", categorical_cols)
+            fig = px.box(df, x=x_col, y=y_col)
+        else:
+            fig = px.box(df, y=y_col)
+        st.plotly_chart(fig, key=f"viz_{viz_type}")
+
+
+def store_column_types(df: pd.DataFrame, file_key):
+    # Column groups for the plot selectors, computed once per uploaded file
+    if st.session_state.get("column_types_file") != file_key:
+        st.session_state["numeric_cols"] = df.select_dtypes(include='number').columns.tolist()
+        # Arrow parses dates and booleans natively; they still work as plot categories
+        st.session_state["categorical_cols"] = df.select_dtypes(
+            include=['object', 'string', 'category', 'bool', 'datetime']
+        ).columns.tolist()
+        st.session_state["column_types_file"] = file_key
+
+
+def get_sample_csv(df: pd.DataFrame, file_key) -> str:
+    # Compact CSV rows for prompts, built once per uploaded file
+    if st.session_state.get("sample_csv_file") != file_key:
+        st.session_state["sample_csv"] = df.head(5).to_csv(index=False)
+        st.session_state["sample_csv_file"] = file_key
+    return st.session_state["sample_csv"]
+
+
+def get_insights(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key) -> Dict:
+    # Overview figures only change with the upload, not on navigation
+    cached = st.session_state.get("insights")
+    if cached is None or cached["file"] != file_key:
+        cached = {"file": file_key, **agent.generate_insights(df)}
+        # Chart data is prepared as an Arrow table once, so reruns skip the chart builder
+        missing = cached["missing_values"]
+        cached["missing_values_table"] = pa.table({
+            "column": [str(col) for col in missing.index],
+            "missing": missing.to_numpy()
         })
+        st.session_state["insights"] = cached
+    return cached
 
-        results = search.get_dict()
-        return [
-            {
-                "title": r.get("title"),
-                "snippet": r.get("snippet"),
-                "link": r.get("link")
-            }
-            for r in results.get("organic_results", [])
-        ]
+
+def get_ai_result(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key, name: str) -> str:
+    # Both AI requests start together per uploaded file; each page only waits on
+    # (and only reports failures of) its own request, and a failed one is retried
+    cached = st.session_state.get("ai_results")
+    if cached is None or cached["file"] != file_key:
+        cached = {"file": file_key}
+        st.session_state["ai_results"] = cached
+    missing = tuple(n for n in ("analysis", "suggestions") if n not in cached)
+    if missing:
+        cached.update(agent.prefetch_analysis(df.columns.tolist(), get_sample_csv(df, file_key), missing))
+    try:
+        return cached[name].result()
+    except Exception:
+        del cached[name]
+        raise
+
+
+def render_overview(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key):
+    st.header("📊 Data Overview")
+    st.write("First few rows of your data:")
+    st.dataframe(df.head())
+
+    # Display basic insights
+    insights = get_insights(agent, df, file_key)
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Total Rows", insights["row_count"])
+        st.metric("Total Columns", insights["column_count"])
+
+    st.subheader("Missing Values Analysis")
+    st.vega_lite_chart(insights["missing_values_table"], MISSING_VALUES_SPEC, use_container_width=True)
+
+
+def render_ai_analysis(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key):
+    st.header("🧠 AI Analysis")
+
+    # Get AI analysis of columns
+    with st.spinner("Generating AI analysis..."):
+        analysis = get_ai_result(agent, df, file_key, "analysis")
+        st.write(analysis)
+
+
+def render_enrichment_suggestions(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key):
+    st.header("✨ Enrichment Suggestions")
+
+    # Get enrichment suggestions
+    with st.spinner("Generating enrichment suggestions..."):
+        suggestions = get_ai_result(agent, df, file_key, "suggestions")
+        st.write(suggestions)
+
+    if len(df) == 0:
+        return
+
+    st.subheader("Enrich Rows")
+    instruction = st.text_input("Describe the fields to add to each row:")
+    row_count = st.number_input("Rows to enrich", min_value=1, max_value=len(df), value=min(20, len(df)))
+
+    if instruction and st.button("Enrich rows"):
+        rows = df.head(row_count)
+        with st.spinner("Enriching rows..."):
+            enriched, failed = agent.enrich_rows(rows.to_dict("records"), instruction)
+        if failed:
+            st.warning(f"{len(failed)} batch(es) failed; their rows were left unchanged.")
+        st.dataframe(agent.apply_enrichments(rows, enriched))
+
+
+def render_chat(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key):
+    st.header("💬 Chat with CSV")
+
+    # Allow user to enter a question
+    query = st.text_input("Ask a question about your data:")
+
+    if query:
+        # Answers are streamed as they are generated and kept for later reruns
+        answers = st.session_state.setdefault("chat_answers", {})
+        answer_key = (file_key, query)
+        if answer_key in answers:
+            st.write(answers[answer_key])
+        else:
+            response = agent.chat_with_csv(query, get_sample_csv(df, file_key))
+            answers[answer_key] = st.write_stream(response)
+
+
+def render_web_search(agent: CSVEnrichmentAgent, df: pd.DataFrame, file_key):
+    st.header("🔍 Dynamic Web Search")
+
+    # Input prompt for web search
+    query = st.text_input("Enter your search query:")
+
+    if query:
+        st.write(f"Searching for: {query}")
+        with st.spinner("Searching..."):
+            results = agent.web_search(query)
+            if results:
+                st.subheader("Search Results:")
+                # One markdown element for all results instead of three per result
+                st.markdown("\n\n".join(
+                    f"**Title:** {result['title']}\n\n"
+                    f"**Snippet:** {result['snippet']}\n\n"
+                    f"[Link]({result['link']})"
+                    for result in results
+                ))
+            else:
+                st.write("No results found.")
+
+
+# Page router; each renderer takes the agent, the loaded frame and the upload key
+PAGES = {
+    "Data Overview": render_overview,
+    "AI Analysis": render_ai_analysis,
+    "Enrichment Suggestions": render_enrichment_suggestions,
+    "Visualizations": render_visualizations,
+    "Chat with CSV": render_chat,
+    "Web Search": render_web_search,
+}
 
 
 def main():
     st.set_page_config(page_title="AI CSV Enrichment Tool", layout="wide")
     st.title("🤖 AI-Powered CSV Analysis & Enrichment")
     
-    # API Key input in sidebar if not found in environment
-    if not get_api_keys():
+    # API Key input in sidebar if not found in environment; the typed key lives in
+    # this session's state so it never leaks to other sessions via os.environ
+    google_key, serp_key = get_api_keys()
+    if not google_key:
         with st.sidebar:
-            api_key = st.text_input("Enter your Google API Key", type="password")
-            if api_key:
-                os.environ['GOOGLE_API_KEY'] = api_key
-            else:
+            google_key = st.text_input("Enter your Google API Key", type="password", key="google_api_key")
+            if not google_key:
                 st.error("Please enter your Google API Key to continue")
                 st.stop()
     
     try:
         # Initialize agent
-        agent = CSVEnrichmentAgent()
+        agent = get_agent(google_key, serp_key)
         
         # File upload
         uploaded_file = st.file_uploader("Upload your CSV file", type=['csv'])
         
         if uploaded_file is not None:
             # Read and display data
-            df = pd.read_csv(uploaded_file)
+            df = load_csv(uploaded_file.getvalue())
+            file_key = uploaded_file.file_id
+            store_column_types(df, file_key)
             
             # Sidebar for navigation
             with st.sidebar:
                 page =  option_menu(
                     "Navigation",
-                    ["Data Overview", "AI Analysis", "Enrichment Suggestions", "Visualizations", "Chat with CSV", "Web Search"],
+                    list(PAGES),
                     icons=["bar-chart", "robot", "stars", "pie-chart", "chat-left-dots", "search"],
                     menu_icon="menu-app",
                     default_index=0,
@@ -169,109 +677,7 @@ def main():
                     }
                 )
             
-            if page == "Data Overview":
-                st.header("📊 Data Overview")
-                st.write("First few rows of your data:")
-                st.dataframe(df.head())
-                
-                # Display basic insights
-                insights = agent.generate_insights(df)
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.metric("Total Rows", insights["row_count"])
-                    st.metric("Total Columns", insights["column_count"])
-                
-                st.subheader("Missing Values Analysis")
-                st.bar_chart(insights["missing_values"])
-                
-            elif page == "AI Analysis":
-                st.header("🧠 AI Analysis")
-                
-                # Get AI analysis of columns
-                with st.spinner("Generating AI analysis..."):
-                    analysis = agent.analyze_columns(df.columns.tolist())
-                    st.write(analysis)
-                
-            elif page == "Enrichment Suggestions":
-                st.header("✨ Enrichment Suggestions")
-                
-                # Get enrichment suggestions
-                with st.spinner("Generating enrichment suggestions..."):
-                    sample_data = df.head().to_string()
-                    suggestions = agent.suggest_enrichments(df.columns.tolist(), sample_data)
-                    st.write(suggestions)
-                
-            elif page == "Visualizations":
-                st.header("📈 Visualizations")
-                
-                # Dynamic visualization options based on data types
-                numeric_cols = df.select_dtypes(include=['float64', 'int64']).columns
-                categorical_cols = df.select_dtypes(include=['object']).columns
-                
-                # Visualization type selector
-                viz_type = st.selectbox(
-                    "Choose visualization type",
-                    ["Scatter Plot", "Bar Chart", "Line Chart", "Box Plot"]
-                )
-                
-                if viz_type == "Scatter Plot" and len(numeric_cols) >= 2:
-                    x_col = st.selectbox("Select X axis", numeric_cols, key="scatter_x")
-                    y_col = st.selectbox("Select Y axis", numeric_cols, key="scatter_y")
-                    fig = px.scatter(df, x=x_col, y=y_col)
-                    st.plotly_chart(fig)
-                    
-                elif viz_type == "Bar Chart" and len(categorical_cols) > 0:
-                    x_col = st.selectbox("Select category", categorical_cols)
-                    if len(numeric_cols) > 0:
-                        y_col = st.selectbox("Select value", numeric_cols)
-                        fig = px.bar(df, x=x_col, y=y_col)
-                        st.plotly_chart(fig)
-                        
-                elif viz_type == "Line Chart" and len(numeric_cols) > 0:
-                    y_col = st.selectbox("Select value", numeric_cols)
-                    fig = px.line(df, y=y_col)
-                    st.plotly_chart(fig)
-                    
-                elif viz_type == "Box Plot" and len(numeric_cols) > 0:
-                    y_col = st.selectbox("Select value", numeric_cols)
-                    if len(categorical_cols) > 0:
-                        x_col = st.selectbox("Select category (optional)", categorical_cols)
-                        fig = px.box(df, x=x_col, y=y_col)
-                    else:
-                        fig = px.box(df, y=y_col)
-                    st.plotly_chart(fig)
-                    
-            elif page == "Chat with CSV":
-                st.header("💬 Chat with CSV")
-                
-                # Allow user to enter a question
-                query = st.text_input("Ask a question about your data:")
-                
-                if query:
-                    # Get response from AI model
-                    with st.spinner("Generating response..."):
-                        response = agent.chat_with_csv(query, df)
-                        st.write(response)
-            
-            elif page == "Web Search":
-                st.header("🔍 Dynamic Web Search")
-                
-                # Input prompt for web search
-                query = st.text_input("Enter your search query:")
-                
-                if query:
-                    st.write(f"Searching for: {query}")
-                    with st.spinner("Searching..."):
-                        results = agent.web_search(query)
-                        if results:
-                            st.subheader("Search Results:")
-                            for result in results:
-                                st.markdown(f"**Title:** {result['title']}")
-                                st.markdown(f"**Snippet:** {result['snippet']}")
-                                st.markdown(f"[Link]({result['link']})")
-                        else:
-                            st.write("No results found.")
+            PAGES[page](agent, df, file_key)
                     
     except Exception as e:
         st.error(f"An error occurred: {str(e)}")